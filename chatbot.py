@@ -1,18 +1,29 @@
 import json
 import os
+import time
 
 from typing import List, Dict
 
 from data_loader import MenuDataLoader
 from rag_system import RAGSystem
 from llm_generator import LLMGenerator
+from degradation import (
+    DEGRADATION_LEVELS,
+    FULL,
+    REDUCED_RERANK,
+    NO_RERANK,
+    SHORT_GENERATION,
+    RETRIEVAL_ONLY,
+    DEADLINE_TRUNCATED,
+    StageLatencyEstimator,
+)
 import config
 
 
 class FoodOrderingChatbot:
     
-    def __init__(self):
-        """Initialize chatbot components"""
+    def __init__(self, rag_system: RAGSystem = None, llm_generator: LLMGenerator = None):
+        """Initialize chatbot components (pre-built components may be passed in)"""
         print("=" * 60)
         print("Vietnamese Food Ordering Chatbot")
         print("LLM + RAG + Reranker System")
@@ -22,34 +33,160 @@ class FoodOrderingChatbot:
         documents = self.menu_loader.get_documents_for_rag()
         print(f"Loaded {len(documents)} menu items")
         
-        self.rag_system = RAGSystem(documents)
-        self.llm_generator = LLMGenerator()
+        parents = None
+        headers = None
+        if config.CHUNK_DOCUMENTS:
+            chunks = self.menu_loader.get_chunks_for_rag()
+            documents = [chunk["text"] for chunk in chunks]
+            parents = [chunk["parent"] for chunk in chunks]
+            headers = [chunk["header"] for chunk in chunks]
+            print(f"Split menu into {len(documents)} chunks")
+        
+        self.rag_system = rag_system if rag_system is not None else RAGSystem(documents, parents, headers=headers)
+        self.llm_generator = llm_generator if llm_generator is not None else LLMGenerator()
+        self.latency_estimator = StageLatencyEstimator()
         
         print("Chatbot initialization complete!")
     
-    def process_query(self, query: str) -> Dict:
+    def process_query(self, query: str, latency_budget_ms: float = None, received_at: float = None) -> Dict:
+        if latency_budget_ms is None:
+            latency_budget_ms = config.LATENCY_BUDGET_MS
+        if latency_budget_ms is not None:
+            # The budget counts from arrival (time.perf_counter()), so time spent queued is included
+            start = received_at if received_at is not None else time.perf_counter()
+            return self.process_query_with_deadline(query, start + latency_budget_ms / 1000)
+        
         context = self.rag_system.get_context(query)
         response = self.llm_generator.generate(query, context)
         
         return {
             "query": query,
             "context": context,
-            "response": response
+            "response": response,
+            "degradation_level": DEGRADATION_LEVELS[FULL]
         }
     
+    def process_query_with_deadline(self, query: str, deadline: float) -> Dict:
+        def remaining_ms() -> float:
+            return (deadline - time.perf_counter()) * 1000
+        
+        estimator = self.latency_estimator
+        full_tokens = config.MAX_NEW_TOKENS
+        short_tokens = estimator.short_generation_tokens(full_tokens)
+        
+        retrieved_docs = self.rag_system.retrieve(query, top_k=config.TOP_K_RETRIEVAL)
+        candidate_docs = [doc for doc, _ in retrieved_docs]
+        reduced_candidates = min(len(candidate_docs), max(config.DEGRADED_RERANK_CANDIDATES, config.TOP_K_RERANK))
+        
+        # Step down the reranker first: full set, smaller set, then none
+        generation_ms = estimator.generation_ms(full_tokens)
+        if remaining_ms() >= estimator.rerank_ms(len(candidate_docs)) + generation_ms:
+            level = FULL
+        elif remaining_ms() >= estimator.rerank_ms(reduced_candidates) + generation_ms:
+            level = REDUCED_RERANK
+            candidate_docs = candidate_docs[:reduced_candidates]
+        else:
+            level = NO_RERANK
+        
+        if level != NO_RERANK and candidate_docs:
+            start = time.perf_counter()
+            reranked_docs = self.rag_system.rerank(query, candidate_docs, top_k=config.TOP_K_RERANK)
+            estimator.update_rerank((time.perf_counter() - start) * 1000, len(candidate_docs))
+        else:
+            estimator.skipped("rerank")
+            reranked_docs = self.rag_system.select_without_rerank(retrieved_docs, top_k=config.TOP_K_RERANK)
+        
+        context = self.rag_system.format_context(reranked_docs)
+        
+        # Then shorten generation, and finally answer from retrieval alone
+        if remaining_ms() >= estimator.generation_ms(full_tokens):
+            max_new_tokens = full_tokens
+        elif remaining_ms() >= estimator.generation_ms(short_tokens):
+            level = max(level, SHORT_GENERATION)
+            max_new_tokens = short_tokens
+        else:
+            level = RETRIEVAL_ONLY
+        
+        if level == RETRIEVAL_ONLY:
+            estimator.skipped("generation")
+            response = self.templated_answer(reranked_docs)
+        else:
+            start = time.perf_counter()
+            # Decoding is also stopped at the deadline, in case it runs slower than estimated
+            response, new_tokens, truncated = self.llm_generator.generate_with_stats(
+                query, context, max_new_tokens=max_new_tokens, max_time=max(remaining_ms(), 0) / 1000
+            )
+            if truncated:
+                level = DEADLINE_TRUNCATED
+            
+            # Cache hits report no generated tokens and say nothing about generation speed
+            if new_tokens is not None:
+                estimator.update_generation(
+                    (time.perf_counter() - start) * 1000, new_tokens, max_new_tokens, truncated
+                )
+        
+        return {
+            "query": query,
+            "context": context,
+            "response": response,
+            "degradation_level": DEGRADATION_LEVELS[level]
+        }
+    
+    def templated_answer(self, reranked_docs: List) -> str:
+        if not reranked_docs:
+            return "Xin lỗi, tôi không tìm thấy thông tin liên quan trong menu. Bạn có thể hỏi về các món khác không?"
+        
+        # Documents and chunks both start with the dish name
+        name = reranked_docs[0][0].split("\n", 1)[0].replace("Tên món ăn:", "").strip()
+        item = self.menu_loader.get_item_by_name(name)
+        if item is None:
+            return f"Bạn có thể tham khảo món {name} trong thực đơn của quán."
+        
+        availability = "vẫn còn hàng" if item["availability"] else "hiện đã hết hàng"
+        return f"Món {item['name']} có giá {item['price']:,}VNĐ và {availability}. {item['short_description']}"
+    
     def process_queries(self, queries: List[str]) -> List[Dict]:
         results = []
         print(f"Processing {len(queries)} queries...\n")
         
-        for i, query in enumerate(queries, 1):
+        # Without a latency budget, retrieve and rerank all queries together so reranker pairs are length-bucketed
+        if config.LATENCY_BUDGET_MS is None:
+            contexts = self.rag_system.get_contexts(queries)
+        else:
+            contexts = [None] * len(queries)
+        
+        for i, (query, context) in enumerate(zip(queries, contexts), 1):
             print(f"[{i}/{len(queries)}] Processing: {query}")
             
-            result = self.process_query(query)
+            if context is None:
+                result = self.process_query(query)
+            else:
+                response = self.llm_generator.generate(query, context)
+                result = {
+                    "query": query,
+                    "context": context,
+                    "response": response,
+                    "degradation_level": DEGRADATION_LEVELS[FULL]
+                }
             results.append(result)
             
             print(f"Response: {result['response']}...")
+            if result["degradation_level"] != DEGRADATION_LEVELS[FULL]:
+                print(f"Served at level: {result['degradation_level']}")
             print()
         
+        rerank_stats = self.rag_system.get_rerank_stats()
+        print(f"Reranker tokens per query: {rerank_stats['rerank_tokens_per_query']:.1f}")
+        print(f"Reranker padding ratio: {rerank_stats['padding_ratio']:.2%}\n")
+        
+        cache = getattr(self.llm_generator, "cache", None)
+        if cache is not None:
+            cache_stats = cache.stats()
+            print(
+                f"Generation cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                f"(hit rate {cache_stats['hit_rate']:.2%}, {cache_stats['entries']} entries)\n"
+            )
+        
         return results
     
     def save_results(self, results: List[Dict]):
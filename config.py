@@ -1,4 +1,5 @@
 import os
+import platform
 
 # Model configurations
 LLM_MODEL = "Qwen/Qwen2.5-3B-Instruct"
@@ -10,6 +11,7 @@ DATA_DIR = "data"
 INPUT_DIR = "input"
 OUTPUT_DIR = "output"
 MODEL_CACHE_DIR = os.path.join(os.getcwd(), "model_cache")
+INDEX_DIR = os.path.join(MODEL_CACHE_DIR, "index")
 
 # Ensure directories exist
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -18,16 +20,48 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
 
 # RAG configurations
-CHUNK_SIZE = 256
+CHUNK_DOCUMENTS = True  # Index field-level chunks of each menu item instead of whole items
+CHUNK_SIZE = 256  # Characters per long-description chunk
 CHUNK_OVERLAP = 32
+CHUNK_CONTEXT = "chunk"  # "chunk": best chunk of each item under a name/price header; "item": the whole item
+CHUNK_SEARCH_FACTOR = 3  # Chunks searched per retrieved item; only the best chunk of each item is reranked
 TOP_K_RETRIEVAL = 10
 TOP_K_RERANK = 3
+RERANK_MAX_LENGTH = 512
+RERANK_BATCH_SIZE = 32
+
+# Embedding dimension reduction: None, "truncate", "pca" or "opq"
+EMBEDDING_REDUCTION = None
+EMBEDDING_DIM = 256
+OPQ_SUBQUANTIZERS = 16
+
+# Inference backend for the embedding model and reranker: "torch" or "onnx"
+INFERENCE_BACKEND = "torch"
+ONNX_CACHE_DIR = os.path.join(MODEL_CACHE_DIR, "onnx")
+ONNX_QUANTIZE = True
+ONNX_QUANTIZATION_TARGET = "arm64" if platform.machine().lower() in ("arm64", "aarch64") else "avx2"
+ONNX_NUM_THREADS = os.cpu_count() or 1
 
 # LLM configurations
 MAX_NEW_TOKENS = 256
 TEMPERATURE = 0.1
 TOP_P = 0.9
 DO_SAMPLE = True
+DETERMINISTIC_DECODING = False  # Greedy decoding, ignores TEMPERATURE/TOP_P/DO_SAMPLE
+
+# Persistent generation cache keyed by model, generation parameters and prompt hash (only used with deterministic decoding)
+GENERATION_CACHE_ENABLED = True
+GENERATION_CACHE_PATH = os.path.join(MODEL_CACHE_DIR, "generation_cache.sqlite")
+GENERATION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Deadline-aware degradation: per-request latency budget in ms (None disables it)
+LATENCY_BUDGET_MS = None
+DEGRADED_RERANK_CANDIDATES = 4  # Menu items reranked when degraded (never fewer than TOP_K_RERANK)
+DEGRADED_MAX_NEW_TOKENS = 64  # Upper bound on short answers
+DEGRADED_GENERATION_FRACTION = 0.5  # Short answers are cut to this fraction of the typical answer length
+INITIAL_RERANK_MS_PER_PAIR = 40
+INITIAL_GENERATION_MS_PER_TOKEN = 60
+INITIAL_GENERATED_TOKENS = 80
 
 # Device configuration
 DEVICE = "cuda" if os.path.exists("/usr/local/cuda") else "cpu"
@@ -112,6 +112,51 @@ Trạng thái: {'Vẫn còn hàng' if item['availability'] else 'Đã hết hàn
 
         return documents
     
+    def split_text(self, text: str) -> List[str]:
+        # Split on word boundaries into pieces of at most CHUNK_SIZE characters, sharing CHUNK_OVERLAP characters
+        pieces = []
+        words = []
+        for word in text.split():
+            if words and len(" ".join(words + [word])) > config.CHUNK_SIZE:
+                pieces.append(" ".join(words))
+                overlap = []
+                for previous in reversed(words):
+                    if len(" ".join([previous] + overlap)) > config.CHUNK_OVERLAP:
+                        break
+                    overlap.insert(0, previous)
+                words = overlap
+            words.append(word)
+        if words:
+            pieces.append(" ".join(words))
+        return pieces
+
+    def get_chunks_for_rag(self) -> List[Dict]:
+        chunks = []
+
+        for parent, item in enumerate(self.menu_data):
+            header = f"Tên món ăn: {item['name']}"
+            fields = [
+                ("summary", f"""\
+Món thuộc hạng mục: {item['category']}
+Đơn giá: {item['price']:,}VNĐ
+Trạng thái: {'Vẫn còn hàng' if item['availability'] else 'Đã hết hàng'}"""),
+                ("short_description", f"Miêu tả ngắn: {item['short_description']}"),
+            ]
+            for piece in self.split_text(item['long_description']):
+                fields.append(("long_description", f"Miêu tả dài: {piece}"))
+
+            # Every chunk repeats the dish name and points back to its menu item;
+            # the name/price header is what the context packer puts above a lone chunk
+            for field, body in fields:
+                chunks.append({
+                    "text": f"{header}\n{body}",
+                    "parent": parent,
+                    "field": field,
+                    "header": f"{header}\nĐơn giá: {item['price']:,}VNĐ",
+                })
+
+        return chunks
+    
     def save_documents(self) -> str:
         documents = self.get_documents_for_rag()
         documents = [f"[Món {i + 1}]\n{doc}" for i, doc in enumerate(documents)]
@@ -0,0 +1,65 @@
+import threading
+
+import config
+
+
+# Service levels, from the full pipeline down to a retrieval-only templated answer,
+# plus answers whose generation was cut off at the deadline
+DEGRADATION_LEVELS = ["full", "reduced_rerank", "no_rerank", "short_generation", "retrieval_only", "deadline_truncated"]
+FULL = 0
+REDUCED_RERANK = 1
+NO_RERANK = 2
+SHORT_GENERATION = 3
+RETRIEVAL_ONLY = 4
+DEADLINE_TRUNCATED = 5
+
+
+class StageLatencyEstimator:
+
+    def __init__(self, smoothing: float = 0.2):
+        self.smoothing = smoothing
+        self.rerank_ms_per_pair = config.INITIAL_RERANK_MS_PER_PAIR
+        self.generation_ms_per_token = config.INITIAL_GENERATION_MS_PER_TOKEN
+        self.generated_tokens = config.INITIAL_GENERATED_TOKENS
+        # Requests served from several threads share one estimator
+        self.lock = threading.Lock()
+
+    def update_rerank(self, elapsed_ms: float, pairs: int):
+        if pairs > 0:
+            observed = elapsed_ms / pairs
+            with self.lock:
+                self.rerank_ms_per_pair += self.smoothing * (observed - self.rerank_ms_per_pair)
+
+    def update_generation(self, elapsed_ms: float, new_tokens: int, max_new_tokens: int, truncated: bool = False):
+        # Prefill is folded into the per-token cost, which keeps the estimate on the safe side
+        observed = elapsed_ms / max(new_tokens, 1)
+        with self.lock:
+            self.generation_ms_per_token += self.smoothing * (observed - self.generation_ms_per_token)
+            # Only answers that ended on their own show the natural length; one stopped at its token cap is a
+            # lower bound, and one cut off at the deadline says nothing about it
+            natural = not truncated and new_tokens < max_new_tokens
+            if natural or (not truncated and new_tokens > self.generated_tokens):
+                self.generated_tokens += self.smoothing * (new_tokens - self.generated_tokens)
+
+    def skipped(self, stage: str):
+        # A skipped stage is never measured, so let its estimate drift down until it gets tried again
+        with self.lock:
+            if stage == "rerank":
+                self.rerank_ms_per_pair *= 1 - self.smoothing / 4
+            else:
+                self.generation_ms_per_token *= 1 - self.smoothing / 4
+
+    def short_generation_tokens(self, max_new_tokens: int) -> int:
+        # A fixed cap saves nothing once typical answers are already shorter, so cut relative to the observed length
+        with self.lock:
+            tokens = int(self.generated_tokens * config.DEGRADED_GENERATION_FRACTION)
+        return max(1, min(tokens, config.DEGRADED_MAX_NEW_TOKENS, max_new_tokens))
+
+    def rerank_ms(self, pairs: int) -> float:
+        with self.lock:
+            return self.rerank_ms_per_pair * pairs
+
+    def generation_ms(self, max_new_tokens: int) -> float:
+        # Answers usually stop before the cap, so expect the typical length seen so far
+        with self.lock:
+            return self.generation_ms_per_token * min(max_new_tokens, self.generated_tokens)
@@ -0,0 +1,213 @@
+import argparse
+import json
+import math
+import os
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+import config
+
+
+REDUCTION_METHODS = ["truncate", "pca", "opq"]
+OPQ_VECTORS_PER_CENTROID = 4
+
+
+class EmbeddingReducer:
+
+    def __init__(self, method: str = None, dimension: int = None):
+        self.method = method if method is not None else config.EMBEDDING_REDUCTION
+        self.dimension = dimension or config.EMBEDDING_DIM
+        self.requested_dimension = self.dimension
+        self.transform = None
+        self.product_quantizer = None
+
+        if self.method is not None and self.method not in REDUCTION_METHODS:
+            raise ValueError(f"Unknown embedding reduction method: {self.method}")
+
+    def fit(self, embeddings: np.ndarray) -> "EmbeddingReducer":
+        if self.method is None:
+            return self
+
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+        input_dimension = embeddings.shape[1]
+        if self.dimension >= input_dimension:
+            raise ValueError(f"Reduced dimension {self.dimension} must be smaller than {input_dimension}")
+
+        if self.method in ("pca", "opq"):
+            # Projections cannot output more dimensions than they have training vectors
+            limit = len(embeddings)
+            if self.method == "opq":
+                if self.dimension % config.OPQ_SUBQUANTIZERS:
+                    raise ValueError(f"OPQ dimension {self.dimension} must be a multiple of {config.OPQ_SUBQUANTIZERS}")
+                limit -= limit % config.OPQ_SUBQUANTIZERS
+            if limit == 0:
+                raise ValueError(f"Too few documents ({len(embeddings)}) to train {self.method}")
+            if self.dimension > limit:
+                print(
+                    f"WARNING: {self.method} trained on {len(embeddings)} documents "
+                    f"can only keep {limit} of the requested {self.dimension} dimensions"
+                )
+                self.dimension = limit
+
+        if self.method == "pca":
+            self.transform = faiss.PCAMatrix(input_dimension, self.dimension)
+            self.transform.train(embeddings)
+        elif self.method == "opq":
+            # The default 8-bit codebooks need 256+ vectors; size them to the corpus instead
+            nbits = max(1, min(8, int(math.log2(len(embeddings) / OPQ_VECTORS_PER_CENTROID))))
+            self.transform = faiss.OPQMatrix(input_dimension, config.OPQ_SUBQUANTIZERS, self.dimension)
+            # OPQMatrix only keeps a raw pointer, so the quantizer must stay referenced
+            self.product_quantizer = faiss.ProductQuantizer(self.dimension, config.OPQ_SUBQUANTIZERS, nbits)
+            self.product_quantizer.cp.min_points_per_centroid = OPQ_VECTORS_PER_CENTROID
+            self.transform.pq = self.product_quantizer
+            self.transform.train(embeddings)
+
+        print(f"Embedding reduction: {self.method} {input_dimension} -> {self.dimension}")
+        return self
+
+    def apply(self, embeddings: np.ndarray) -> np.ndarray:
+        if self.method is None:
+            return embeddings
+
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+        if self.method == "truncate":
+            reduced = np.ascontiguousarray(embeddings[:, :self.dimension])
+        else:
+            reduced = self.transform.apply_py(embeddings)
+
+        # Re-normalize so inner product search still ranks by cosine similarity
+        faiss.normalize_L2(reduced)
+        return reduced
+
+    def save(self, path_prefix: str):
+        with open(f"{path_prefix}.reduction.json", "w", encoding="utf-8") as f:
+            json.dump(
+                {"method": self.method, "dimension": self.dimension, "requested_dimension": self.requested_dimension},
+                f,
+                indent=2
+            )
+        if self.transform is not None:
+            faiss.write_VectorTransform(self.transform, f"{path_prefix}.projection")
+
+    @classmethod
+    def load(cls, path_prefix: str) -> "EmbeddingReducer":
+        with open(f"{path_prefix}.reduction.json", "r", encoding="utf-8") as f:
+            settings = json.load(f)
+
+        reducer = cls(settings["method"], settings["dimension"])
+        # A saved "no reduction" must not fall back to the configured method
+        reducer.method = settings["method"]
+        reducer.requested_dimension = settings.get("requested_dimension", settings["dimension"])
+        if os.path.exists(f"{path_prefix}.projection"):
+            reducer.transform = faiss.read_VectorTransform(f"{path_prefix}.projection")
+        return reducer
+
+
+def recall_at_k(reference: np.ndarray, candidates: np.ndarray) -> float:
+    hits = [len(set(ref) & set(cand)) / len(ref) for ref, cand in zip(reference, candidates)]
+    return sum(hits) / len(hits) if hits else 0.0
+
+
+def check_reduction_recall(
+    doc_embeddings: np.ndarray,
+    query_embeddings: np.ndarray,
+    methods: List[str],
+    dimensions: List[int],
+    top_k: int
+) -> List[Dict]:
+    doc_embeddings = np.ascontiguousarray(doc_embeddings, dtype="float32")
+    query_embeddings = np.ascontiguousarray(query_embeddings, dtype="float32")
+    top_k = min(top_k, len(doc_embeddings))
+
+    # Full-dimension neighbours are the reference
+    full_index = faiss.IndexFlatIP(doc_embeddings.shape[1])
+    full_index.add(doc_embeddings)
+    _, reference = full_index.search(query_embeddings, top_k)
+
+    results = []
+    for method in methods:
+        fitted_dimensions = set()
+        for dimension in dimensions:
+            try:
+                reducer = EmbeddingReducer(method, dimension).fit(doc_embeddings)
+            except ValueError as e:
+                print(f"Skipping {method} {dimension}: {e}")
+                continue
+            # Clamped projections can end up identical; report each effective dimension once
+            if reducer.dimension in fitted_dimensions:
+                print(f"Skipping {method} {dimension}: same as {method} {reducer.dimension}")
+                continue
+            fitted_dimensions.add(reducer.dimension)
+            index = faiss.IndexFlatIP(reducer.dimension)
+            index.add(reducer.apply(doc_embeddings))
+            _, candidates = index.search(reducer.apply(query_embeddings), top_k)
+
+            results.append({
+                "method": method,
+                "requested_dimension": dimension,
+                "dimension": reducer.dimension,
+                f"recall@{top_k}": recall_at_k(reference, candidates),
+                "top1_agreement": float(np.mean(reference[:, 0] == candidates[:, 0])),
+                "index_bytes": index.ntotal * reducer.dimension * 4,
+            })
+
+    return results
+
+
+def main():
+    from data_loader import MenuDataLoader
+    from rag_system import load_embedding_model
+
+    parser = argparse.ArgumentParser(
+        description="Compare retrieval recall@k of reduced-dimension embeddings against full dimension"
+    )
+    parser.add_argument('--methods', type=str, default=",".join(REDUCTION_METHODS),
+                        help='Comma-separated reduction methods to check')
+    parser.add_argument('--dims', type=str, default='128,256,512',
+                        help='Comma-separated target dimensions')
+    parser.add_argument('--top-k', type=int, default=config.TOP_K_RETRIEVAL)
+    args = parser.parse_args()
+
+    with open(os.path.join(config.INPUT_DIR, "queries.json"), "r", encoding="utf-8") as f:
+        queries = [pair["question"] for pair in json.load(f)]
+    documents = MenuDataLoader().get_documents_for_rag()
+
+    embedding_model = load_embedding_model()
+    doc_embeddings = embedding_model.encode(documents, convert_to_numpy=True, normalize_embeddings=True)
+    query_embeddings = embedding_model.encode(queries, convert_to_numpy=True, normalize_embeddings=True)
+
+    results = check_reduction_recall(
+        doc_embeddings,
+        query_embeddings,
+        [method for method in args.methods.split(",") if method],
+        [int(dim) for dim in args.dims.split(",") if dim],
+        args.top_k
+    )
+
+    full_bytes = doc_embeddings.shape[0] * doc_embeddings.shape[1] * 4
+    recall_key = f"recall@{min(args.top_k, len(documents))}"
+    print("\n" + "=" * 60)
+    print(f"Embedding Reduction Recall (full dimension {doc_embeddings.shape[1]}, {full_bytes} bytes)")
+    print("=" * 60)
+    for result in results:
+        dimension = str(result["dimension"])
+        if result["dimension"] != result["requested_dimension"]:
+            dimension = f"{result['requested_dimension']}->{dimension}"
+        print(
+            f"{result['method']:>9} {dimension:>9}  "
+            f"{recall_key}: {result[recall_key]:.4f}  "
+            f"top-1: {result['top1_agreement']:.2%}  "
+            f"index: {result['index_bytes']} bytes"
+        )
+    print("=" * 60)
+
+    output_file = os.path.join(config.OUTPUT_DIR, "embedding_reduction_recall.json")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Saved: {output_file}")
+
+
+if __name__ == "__main__":
+    main()
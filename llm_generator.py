@@ -1,15 +1,17 @@
 import re
+import time
 import torch
 
 from transformers import AutoModelForCausalLM, AutoTokenizer
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 import config
+from generation_cache import GenerationCache
 
 
 class LLMGenerator:
     
-    def __init__(self):
+    def __init__(self, load_model: bool = True):
         print("Initializing LLM...")
         print(f"Loading model: {config.LLM_MODEL}")
         
@@ -20,6 +22,20 @@ class LLMGenerator:
             trust_remote_code=True
         )
         
+        # Tokenizer-only mode is enough to build prompts and count tokens
+        if not load_model:
+            self.model = None
+            self.cache = None
+            return
+        
+        # Sampled answers are not cached, otherwise every run would replay the first sample
+        self.cache = None
+        if config.GENERATION_CACHE_ENABLED and (config.DETERMINISTIC_DECODING or not config.DO_SAMPLE):
+            self.cache = GenerationCache(config.GENERATION_CACHE_PATH, config.GENERATION_CACHE_MAX_BYTES)
+            print(f"Generation cache: {config.GENERATION_CACHE_PATH}")
+        elif config.GENERATION_CACHE_ENABLED:
+            print("Generation cache disabled: sampling is on (set DETERMINISTIC_DECODING = True to cache answers)")
+        
         # Load model with optimizations for low-resource environments
         self.model = AutoModelForCausalLM.from_pretrained(
             config.LLM_MODEL,
@@ -102,8 +118,43 @@ Xin lỗi, tôi không tìm thấy thông tin liên quan trong menu. Hãy trả
         
         return prompt
     
-    def generate(self, query: str, context: str = "") -> str:
+    def get_generation_params(self, max_new_tokens: int) -> Dict:
+        # Greedy decoding makes answers reproducible across runs
+        if config.DETERMINISTIC_DECODING:
+            return {"max_new_tokens": max_new_tokens, "do_sample": False}
+        
+        return {
+            "max_new_tokens": max_new_tokens,
+            "temperature": config.TEMPERATURE,
+            "top_p": config.TOP_P,
+            "do_sample": config.DO_SAMPLE,
+        }
+    
+    def generate(self, query: str, context: str = "", max_new_tokens: int = None) -> str:
+        return self.generate_with_stats(query, context, max_new_tokens)[0]
+    
+    def generate_with_stats(
+        self,
+        query: str,
+        context: str = "",
+        max_new_tokens: int = None,
+        max_time: float = None
+    ) -> Tuple[str, Optional[int], bool]:
+        # Returns the response, the generated token count (None on a cache hit) and whether max_time cut it off;
+        # stats are returned per call, so concurrent requests never read each other's
+        if max_new_tokens is None:
+            max_new_tokens = config.MAX_NEW_TOKENS
+        
         prompt = self.create_prompt(query, context)
+        generation_params = self.get_generation_params(max_new_tokens)
+        
+        cache_key = None
+        if self.cache is not None:
+            cache_key = GenerationCache.make_key(config.LLM_MODEL, generation_params, prompt)
+            cached_response = self.cache.get(cache_key)
+            if cached_response is not None:
+                return cached_response, None, False
+        
         inputs = self.tokenizer(
             prompt,
             return_tensors="pt",
@@ -112,17 +163,19 @@ Xin lỗi, tôi không tìm thấy thông tin liên quan trong menu. Hãy trả
         )
         inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
 
+        # max_time (seconds) stops decoding at the request deadline; it is not part of the cache key
+        start = time.perf_counter()
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
-                max_new_tokens=config.MAX_NEW_TOKENS,
-                temperature=config.TEMPERATURE,
-                top_p=config.TOP_P,
-                do_sample=config.DO_SAMPLE,
+                **generation_params,
+                max_time=max_time,
                 pad_token_id=self.tokenizer.pad_token_id,
                 eos_token_id=self.tokenizer.eos_token_id
             )
+        timed_out = max_time is not None and time.perf_counter() - start >= max_time
         
+        new_tokens = outputs.shape[1] - inputs["input_ids"].shape[1]
         full_response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
         
         pattern = r"assistant\n(.*)"
@@ -132,8 +185,12 @@ Xin lỗi, tôi không tìm thấy thông tin liên quan trong menu. Hãy trả
         if response.startswith("assistant"):
             response = response[len("assistant"):].strip()
         response = re.sub(r"\s+", " ", response).strip()
+        
+        # An answer cut off by the deadline must not be replayed to requests with time to spare
+        if cache_key is not None and not timed_out:
+            self.cache.put(cache_key, response)
 
-        return response
+        return response, new_tokens, timed_out
     
     def batch_generate(self, queries: List[str], contexts: List[str]) -> List[str]:
         responses = []
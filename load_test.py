@@ -0,0 +1,460 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.request
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import config
+
+
+PARAPHRASE_PREFIXES = ["", "Cho mình hỏi ", "Bạn ơi, ", "Xin hỏi ", "Mình muốn biết ", "Nhà hàng ơi, "]
+PARAPHRASE_SUFFIXES = ["", " ạ", " vậy", " nhé", " bạn"]
+
+
+class StandInNode:
+
+    def __init__(self, cores: int):
+        self.free_cores = cores
+        self.waiting = deque()
+        self.lock = threading.Lock()
+
+    def compute(self, milliseconds: float):
+        # Hold one core while the work runs; sleeping releases the GIL, so up to `cores` stages overlap
+        with self.lock:
+            turn = None
+            if self.free_cores > 0 and not self.waiting:
+                self.free_cores -= 1
+            else:
+                turn = threading.Event()
+                self.waiting.append(turn)
+        if turn is not None:
+            turn.wait()
+
+        try:
+            time.sleep(milliseconds / 1000)
+        finally:
+            # Hand the core to the longest waiting stage, like a run queue, so no request starves
+            with self.lock:
+                if self.waiting:
+                    self.waiting.popleft().set()
+                else:
+                    self.free_cores += 1
+
+
+class StandInRAGSystem:
+
+    def __init__(self, documents: List[str], node: StandInNode, retrieval_ms: float = 20, rerank_ms_per_pair: float = 6):
+        self.documents = documents
+        self.node = node
+        self.retrieval_ms = retrieval_ms
+        self.rerank_ms_per_pair = rerank_ms_per_pair
+        self.doc_tokens = [set(doc.lower().split()) for doc in documents]
+
+    def score(self, query: str) -> Dict[str, float]:
+        # Word overlap stands in for both dense similarity and cross-encoder scores
+        query_tokens = set(query.lower().split())
+        return {
+            doc: len(query_tokens & tokens) / (len(query_tokens) or 1)
+            for doc, tokens in zip(self.documents, self.doc_tokens)
+        }
+
+    def retrieve(self, query: str, top_k: int = None) -> List[Tuple[str, float]]:
+        self.node.compute(self.retrieval_ms)
+
+        ranked = sorted(self.score(query).items(), key=lambda x: x[1], reverse=True)
+        return ranked[:top_k or config.TOP_K_RETRIEVAL]
+
+    def rerank(self, query: str, documents: List[str], top_k: int = None) -> List[Tuple[str, float]]:
+        self.node.compute(self.rerank_ms_per_pair * len(documents))
+
+        scores = self.score(query)
+        reranked = sorted(((doc, scores.get(doc, 0.0)) for doc in documents), key=lambda x: x[1], reverse=True)
+        return reranked[:top_k or config.TOP_K_RERANK]
+
+    def select_without_rerank(self, retrieved_docs: List[Tuple[str, float]], top_k: int = None) -> List[Tuple[str, float]]:
+        return retrieved_docs[:top_k or config.TOP_K_RERANK]
+
+    def retrieve_and_rerank(self, query: str) -> List[Tuple[str, float]]:
+        retrieved_docs = self.retrieve(query, top_k=config.TOP_K_RETRIEVAL)
+        return self.rerank(query, [doc for doc, _ in retrieved_docs], top_k=config.TOP_K_RERANK)
+
+    def format_context(self, reranked_docs: List[Tuple[str, float]]) -> str:
+        return "\n\n".join(
+            f"[Thông tin {i}] (Độ liên quan: {score:.3f})\n{doc}"
+            for i, (doc, score) in enumerate(reranked_docs, 1)
+        )
+
+    def get_context(self, query: str) -> str:
+        return self.format_context(self.retrieve_and_rerank(query))
+
+    def get_contexts(self, queries: List[str]) -> List[str]:
+        return [self.get_context(query) for query in queries]
+
+    def get_rerank_stats(self) -> Dict:
+        return {"queries": 0, "rerank_tokens_per_query": 0, "padding_ratio": 0}
+
+
+class StandInLLMGenerator:
+
+    def __init__(self, node: StandInNode, prefill_ms: float = 150, per_token_ms: float = 15, new_tokens: int = 60):
+        self.node = node
+        self.prefill_ms = prefill_ms
+        self.per_token_ms = per_token_ms
+        self.new_tokens = new_tokens
+
+    def generate(self, query: str, context: str = "", max_new_tokens: int = None) -> str:
+        return self.generate_with_stats(query, context, max_new_tokens)[0]
+
+    def generate_with_stats(
+        self,
+        query: str,
+        context: str = "",
+        max_new_tokens: int = None,
+        max_time: float = None
+    ) -> Tuple[str, int, bool]:
+        if max_new_tokens is None:
+            max_new_tokens = config.MAX_NEW_TOKENS
+
+        # Decode token by token so long generations share cores with other requests,
+        # stopping at max_time like the time limit of HF generate
+        start = time.perf_counter()
+        self.node.compute(self.prefill_ms)
+        new_tokens = 0
+        timed_out = False
+        while new_tokens < min(self.new_tokens, max_new_tokens):
+            self.node.compute(self.per_token_ms)
+            new_tokens += 1
+            if max_time is not None and time.perf_counter() - start >= max_time:
+                timed_out = new_tokens < min(self.new_tokens, max_new_tokens)
+                break
+
+        match_result = re.search(r"Tên món ăn: (.*)", context)
+        if match_result:
+            return f"Món {match_result.group(1).strip()} có trong thực đơn của quán.", new_tokens, timed_out
+        return "Xin lỗi, tôi không tìm thấy thông tin liên quan trong menu.", new_tokens, timed_out
+
+
+def load_questions() -> List[str]:
+    input_file = os.path.join(config.INPUT_DIR, "queries.json")
+    with open(input_file, "r", encoding="utf-8") as f:
+        return [pair["question"] for pair in json.load(f)]
+
+
+def expand_queries(questions: List[str], num_requests: int, rng: random.Random) -> List[str]:
+    # Original questions first, then prefix/suffix paraphrases until the volume is reached
+    queries = list(questions[:num_requests])
+    while len(queries) < num_requests:
+        question = rng.choice(questions).rstrip("?.! ")
+        prefix = rng.choice(PARAPHRASE_PREFIXES)
+        suffix = rng.choice(PARAPHRASE_SUFFIXES)
+        if prefix:
+            question = question[0].lower() + question[1:]
+        queries.append(f"{prefix}{question}{suffix}?")
+    return queries
+
+
+def arrival_times(num_requests: int, arrival: str, rate: float, burst_size: int, rng: random.Random) -> List[float]:
+    if arrival == "closed":
+        return [0.0] * num_requests
+
+    times = []
+    now = 0.0
+    if arrival == "poisson":
+        for _ in range(num_requests):
+            now += rng.expovariate(rate)
+            times.append(now)
+    else:
+        # Bursty: groups of burst_size arrive together, gaps keep the same mean rate
+        while len(times) < num_requests:
+            now += rng.expovariate(rate / burst_size)
+            times.extend([now] * min(burst_size, num_requests - len(times)))
+    return times
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def make_inprocess_target(chatbot, latency_budget_ms: float = None) -> Callable[[str, float], Dict]:
+    def send(query: str, received_at: float) -> Dict:
+        return chatbot.process_query(query, latency_budget_ms=latency_budget_ms, received_at=received_at)
+    return send
+
+
+def make_http_target(endpoint: str, timeout: float) -> Callable[[str, float], Dict]:
+    def send(query: str, received_at: float) -> Dict:
+        request = urllib.request.Request(
+            endpoint,
+            data=json.dumps({"query": query}, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+    return send
+
+
+def run_level(
+    target: Callable[[str, float], Dict],
+    queries: List[str],
+    concurrency: int,
+    arrival: str,
+    rate: float,
+    burst_size: int,
+    seed: int
+) -> Dict:
+    rng = random.Random(seed)
+    schedule = arrival_times(len(queries), arrival, rate, burst_size, rng)
+    records = []
+    lock = threading.Lock()
+
+    def handle(query: str, scheduled: float):
+        started = time.perf_counter()
+        if arrival == "closed":
+            # Closed loop: a worker sends the next request as soon as it is free
+            scheduled = started
+        error = None
+        level = None
+        try:
+            result = target(query, scheduled)
+            if isinstance(result, dict):
+                level = result.get("degradation_level")
+        except Exception as e:
+            error = str(e)
+        finished = time.perf_counter()
+        with lock:
+            records.append({
+                "queue_wait": started - scheduled,
+                "service_time": finished - started,
+                "latency": finished - scheduled,
+                "finished": finished,
+                "error": error,
+                "level": level,
+            })
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for query, offset in zip(queries, schedule):
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(handle, query, start + offset)
+    duration = max(record["finished"] for record in records) - start if records else 0.0
+
+    successes = [record for record in records if record["error"] is None]
+    latencies = [record["latency"] * 1000 for record in successes]
+    queue_waits = [record["queue_wait"] * 1000 for record in successes]
+    service_times = [record["service_time"] * 1000 for record in successes]
+    levels = {}
+    for record in successes:
+        if record["level"] is not None:
+            levels[record["level"]] = levels.get(record["level"], 0) + 1
+
+    return {
+        "concurrency": concurrency,
+        "arrival": arrival,
+        "offered_rate": None if arrival == "closed" else rate,
+        "requests": len(records),
+        "errors": len(records) - len(successes),
+        "duration_s": duration,
+        "throughput_rps": len(successes) / duration if duration > 0 else 0.0,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else 0.0,
+        },
+        "queue_wait_ms_p95": percentile(queue_waits, 95),
+        "service_time_ms_p50": percentile(service_times, 50),
+        "degradation_levels": levels,
+    }
+
+
+def format_summary(report: Dict) -> str:
+    lines = [
+        "=" * 80,
+        "Load Test Summary",
+        "=" * 80,
+        f"Target: {report['target']}",
+        f"Arrival pattern: {report['arrival']}",
+        f"Requests per level: {report['num_requests']}",
+        "",
+        f"{'conc':>5} {'rate':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queue p95':>10} {'errors':>7}",
+        "-" * 80,
+    ]
+    for level in report["levels"]:
+        rate = "-" if level["offered_rate"] is None else f"{level['offered_rate']:.2f}"
+        lines.append(
+            f"{level['concurrency']:>5} {rate:>7} {level['throughput_rps']:>8.2f} "
+            f"{level['latency_ms']['p50']:>9.1f} {level['latency_ms']['p95']:>9.1f} "
+            f"{level['latency_ms']['p99']:>9.1f} {level['queue_wait_ms_p95']:>10.1f} {level['errors']:>7}"
+        )
+        if set(level["degradation_levels"]) - {"full"}:
+            served = ", ".join(f"{name}={count}" for name, count in sorted(level["degradation_levels"].items()))
+            lines.append(f"{'':>5} served at: {served}")
+
+    for curve in report["curves"]:
+        rate = "closed loop" if curve["offered_rate"] is None else f"offered rate {curve['offered_rate']:.2f} req/s"
+        lines.append("")
+        lines.append(f"Saturation curve, {rate} (throughput vs p95 latency):")
+        peak = max(point["throughput_rps"] for point in curve["points"]) or 1.0
+        for point in curve["points"]:
+            gain = "" if point["throughput_gain"] is None else f"{point['throughput_gain']:+.0%}"
+            bar = "#" * round(30 * point["throughput_rps"] / peak)
+            lines.append(
+                f"{point['concurrency']:>5} {bar:<30} {point['throughput_rps']:>6.2f} rps "
+                f"{gain:>6} p95 {point['p95_ms']:>9.1f} ms"
+            )
+
+        saturation = curve["saturation"]
+        lines.append(
+            f"Saturates at concurrency {saturation['concurrency']}: "
+            f"{saturation['throughput_rps']:.2f} req/s, p95 {saturation['p95_ms']:.1f} ms"
+        )
+    lines.append("=" * 80)
+    return "\n".join(lines)
+
+
+def saturation_curve(levels: List[Dict]) -> List[Dict]:
+    # Throughput gained by each level over the previous one; gains near zero while p95 grows mark saturation
+    curve = []
+    previous = None
+    for level in levels:
+        gain = None
+        if previous is not None and previous["throughput_rps"] > 0:
+            gain = level["throughput_rps"] / previous["throughput_rps"] - 1
+        curve.append({
+            "concurrency": level["concurrency"],
+            "throughput_rps": level["throughput_rps"],
+            "p95_ms": level["latency_ms"]["p95"],
+            "throughput_gain": gain,
+        })
+        previous = level
+    return curve
+
+
+def saturation_point(curve: List[Dict], fraction: float = 0.95) -> Dict:
+    # The cheapest level already delivering nearly the peak throughput
+    peak = max(point["throughput_rps"] for point in curve)
+    return next(point for point in curve if point["throughput_rps"] >= fraction * peak)
+
+
+def saturation_curves(levels: List[Dict]) -> List[Dict]:
+    # Concurrency levels are only comparable at the same offered rate, so build one curve per rate
+    rates = []
+    for level in levels:
+        if level["offered_rate"] not in rates:
+            rates.append(level["offered_rate"])
+
+    curves = []
+    for rate in rates:
+        points = saturation_curve(
+            sorted((level for level in levels if level["offered_rate"] == rate), key=lambda level: level["concurrency"])
+        )
+        curves.append({"offered_rate": rate, "points": points, "saturation": saturation_point(points)})
+    return curves
+
+
+def parse_list(value: str, cast) -> List:
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the food ordering chatbot with realistic arrival patterns"
+    )
+    parser.add_argument('--target', choices=['inprocess', 'http'], default='inprocess',
+                        help='Send requests to an in-process FoodOrderingChatbot or a local HTTP endpoint')
+    parser.add_argument('--endpoint', type=str, default='http://127.0.0.1:8000/query',
+                        help='Endpoint accepting POST {"query": ...} when --target http')
+    parser.add_argument('--stand-in', action='store_true',
+                        help='Use stand-in retrieval and generation (offline, no model downloads)')
+    parser.add_argument('--cores', type=int, default=4,
+                        help='CPU cores of the simulated node; stand-in stages run at most this many at once')
+    parser.add_argument('--num-requests', type=int, default=200,
+                        help='Requests per level; queries.json is expanded with paraphrases to reach it')
+    parser.add_argument('--concurrency', type=str, default='1,2,4,8',
+                        help='Comma-separated worker counts to sweep')
+    parser.add_argument('--arrival', choices=['closed', 'poisson', 'bursty'], default='closed',
+                        help='closed: back-to-back requests; poisson/bursty: open-loop arrivals at --rate')
+    parser.add_argument('--rate', type=str, default='2',
+                        help='Comma-separated offered rates (req/s) to sweep for open-loop arrivals')
+    parser.add_argument('--burst-size', type=int, default=8, help='Requests per burst for bursty arrivals')
+    parser.add_argument('--latency-budget', type=float, default=None,
+                        help='Per-request latency budget in ms passed to process_query (in-process only)')
+    parser.add_argument('--generation-cache', action='store_true',
+                        help='Keep the persistent generation cache on; every level replays the same queries, so hits would hide generation cost')
+    parser.add_argument('--timeout', type=float, default=120, help='HTTP request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    queries = expand_queries(load_questions(), args.num_requests, rng)
+
+    if args.target == 'http':
+        target = make_http_target(args.endpoint, args.timeout)
+        target_name = args.endpoint
+    else:
+        from chatbot import FoodOrderingChatbot
+        from data_loader import MenuDataLoader
+
+        config.GENERATION_CACHE_ENABLED = args.generation_cache
+
+        if args.stand_in:
+            documents = MenuDataLoader().get_documents_for_rag()
+            node = StandInNode(args.cores)
+            chatbot = FoodOrderingChatbot(
+                rag_system=StandInRAGSystem(documents, node),
+                llm_generator=StandInLLMGenerator(node)
+            )
+            target_name = f"in-process (stand-in models, {args.cores} cores)"
+        else:
+            chatbot = FoodOrderingChatbot()
+            target_name = "in-process"
+        target = make_inprocess_target(chatbot, args.latency_budget)
+
+    rates = [0.0] if args.arrival == 'closed' else parse_list(args.rate, float)
+    levels = []
+    for rate in rates:
+        for concurrency in parse_list(args.concurrency, int):
+            print(f"Running concurrency={concurrency} arrival={args.arrival} rate={rate or '-'}...")
+            levels.append(run_level(
+                target, queries, concurrency, args.arrival, rate, args.burst_size, args.seed
+            ))
+
+    report = {
+        "target": target_name,
+        "arrival": args.arrival,
+        "num_requests": len(queries),
+        "levels": levels,
+        "curves": saturation_curves(levels),
+    }
+    summary = format_summary(report)
+    print("\n" + summary)
+
+    output_json = os.path.join(config.OUTPUT_DIR, "load_test.json")
+    with open(output_json, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    output_summary = os.path.join(config.OUTPUT_DIR, "load_test_summary.txt")
+    with open(output_summary, 'w', encoding='utf-8') as f:
+        f.write(summary + "\n")
+    print(f"Saved: {output_json}")
+    print(f"Saved: {output_summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import sys
 from data_loader import InputLoader
 from chatbot import FoodOrderingChatbot
 from evaluator import ChatbotEvaluator
+import config
 
 
 def main():
@@ -21,9 +22,18 @@ def main():
         action='store_true',
         help='Evaluate chatbot performance after batch processing'
     )
+    parser.add_argument(
+        '--latency-budget',
+        type=float,
+        default=None,
+        help='Per-request latency budget in ms; the pipeline degrades gracefully as the deadline nears'
+    )
     
     args = parser.parse_args()
     
+    if args.latency_budget is not None:
+        config.LATENCY_BUDGET_MS = args.latency_budget
+    
     try:
         chatbot = FoodOrderingChatbot()
         
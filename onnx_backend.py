@@ -0,0 +1,279 @@
+import argparse
+import os
+import sys
+from typing import Dict, List, Union
+
+import numpy as np
+import onnxruntime as ort
+from optimum.onnxruntime import (
+    ORTModelForFeatureExtraction,
+    ORTModelForSequenceClassification,
+    ORTQuantizer,
+)
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+import config
+
+
+def get_export_dir(model_name: str) -> str:
+    suffix = "int8" if config.ONNX_QUANTIZE else "fp32"
+    return os.path.join(config.ONNX_CACHE_DIR, f"{model_name.replace('/', '--')}-{suffix}")
+
+
+def get_model_file() -> str:
+    return "model_quantized.onnx" if config.ONNX_QUANTIZE else "model.onnx"
+
+
+def create_session_options() -> ort.SessionOptions:
+    session_options = ort.SessionOptions()
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    session_options.intra_op_num_threads = config.ONNX_NUM_THREADS
+    session_options.inter_op_num_threads = 1
+    return session_options
+
+
+def get_provider() -> str:
+    if config.DEVICE == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+        return "CUDAExecutionProvider"
+    return "CPUExecutionProvider"
+
+
+def export_model(model_name: str, model_class) -> str:
+    export_dir = get_export_dir(model_name)
+    model_file = get_model_file()
+
+    if os.path.exists(os.path.join(export_dir, model_file)):
+        return export_dir
+
+    # Export once from the PyTorch checkpoint, then reuse the cached graph
+    print(f"Exporting {model_name} to ONNX: {export_dir}")
+    model = model_class.from_pretrained(
+        model_name,
+        export=True,
+        cache_dir=config.MODEL_CACHE_DIR
+    )
+    model.save_pretrained(export_dir)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, cache_dir=config.MODEL_CACHE_DIR)
+    tokenizer.save_pretrained(export_dir)
+
+    if config.ONNX_QUANTIZE:
+        print(f"Quantizing {model_name} to int8 ({config.ONNX_QUANTIZATION_TARGET})...")
+        quantizer = ORTQuantizer.from_pretrained(export_dir)
+        quantization_config = getattr(AutoQuantizationConfig, config.ONNX_QUANTIZATION_TARGET)(
+            is_static=False,
+            per_channel=False
+        )
+        quantizer.quantize(
+            save_dir=export_dir,
+            quantization_config=quantization_config,
+            use_external_data_format=True
+        )
+
+    return export_dir
+
+
+def load_model(model_name: str, model_class):
+    export_dir = export_model(model_name, model_class)
+    model_file = get_model_file()
+
+    model = model_class.from_pretrained(
+        export_dir,
+        file_name=model_file,
+        provider=get_provider(),
+        session_options=create_session_options()
+    )
+    tokenizer = AutoTokenizer.from_pretrained(export_dir)
+    return model, tokenizer
+
+
+class ONNXEmbedder:
+
+    def __init__(self, model_name: str = None, max_length: int = 8192, batch_size: int = 32):
+        self.model_name = model_name or config.EMBEDDING_MODEL
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.model, self.tokenizer = load_model(self.model_name, ORTModelForFeatureExtraction)
+        # The exported graph (fp32 or int8) determines the vectors, so saved indexes are tied to it
+        self.model_path = os.path.join(get_export_dir(self.model_name), get_model_file())
+
+    def encode(
+        self,
+        sentences: List[str],
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = True
+    ) -> np.ndarray:
+        all_embeddings = []
+
+        for start in range(0, len(sentences), self.batch_size):
+            batch = sentences[start:start + self.batch_size]
+            inputs = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            outputs = self.model(**inputs)
+
+            # bge-m3 dense embeddings use CLS pooling
+            embeddings = np.asarray(outputs.last_hidden_state)[:, 0]
+            if normalize_embeddings:
+                norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+                embeddings = embeddings / np.clip(norms, 1e-12, None)
+            all_embeddings.append(embeddings.astype("float32"))
+
+            if show_progress_bar:
+                print(f"Encoded {min(start + self.batch_size, len(sentences))}/{len(sentences)}")
+
+        if not all_embeddings:
+            return np.zeros((0, self.model.config.hidden_size), dtype="float32")
+
+        return np.concatenate(all_embeddings, axis=0)
+
+
+class ONNXReranker:
+
+    def __init__(self, model_name: str = None, max_length: int = None, batch_size: int = None):
+        self.model_name = model_name or config.RERANKER_MODEL
+        self.max_length = max_length or config.RERANK_MAX_LENGTH
+        self.batch_size = batch_size or config.RERANK_BATCH_SIZE
+        self.model, self.tokenizer = load_model(self.model_name, ORTModelForSequenceClassification)
+
+    def compute_score(self, sentence_pairs: List[List[str]], normalize: bool = False) -> Union[float, List[float]]:
+        if isinstance(sentence_pairs[0], str):
+            sentence_pairs = [sentence_pairs]
+
+        all_scores = []
+        for start in range(0, len(sentence_pairs), self.batch_size):
+            batch = sentence_pairs[start:start + self.batch_size]
+            inputs = self.tokenizer(
+                [query for query, _ in batch],
+                [doc for _, doc in batch],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            outputs = self.model(**inputs)
+            all_scores.extend(np.asarray(outputs.logits).reshape(-1).tolist())
+
+        if normalize:
+            all_scores = [float(1 / (1 + np.exp(-score))) for score in all_scores]
+
+        # Match FlagReranker: a single pair returns a bare score
+        if len(all_scores) == 1:
+            return all_scores[0]
+        return all_scores
+
+    def score_features(self, features: List[Dict]) -> List[float]:
+        inputs = self.tokenizer.pad(features, padding=True, return_tensors="np")
+        outputs = self.model(**inputs)
+        return np.asarray(outputs.logits).reshape(-1).tolist()
+
+
+def check_parity(documents: List[str], queries: List[str], top_k: int = None) -> dict:
+    from sentence_transformers import SentenceTransformer
+    from FlagEmbedding import FlagReranker
+
+    if top_k is None:
+        top_k = config.TOP_K_RETRIEVAL
+    top_k = min(top_k, len(documents))
+
+    print("Loading PyTorch reference models...")
+    torch_embedder = SentenceTransformer(
+        config.EMBEDDING_MODEL,
+        cache_folder=config.MODEL_CACHE_DIR,
+        device=config.DEVICE
+    )
+    torch_reranker = FlagReranker(
+        config.RERANKER_MODEL,
+        cache_dir=config.MODEL_CACHE_DIR,
+        use_fp16=True if config.DEVICE == "cuda" else False
+    )
+
+    print("Loading ONNX Runtime models...")
+    onnx_embedder = ONNXEmbedder()
+    onnx_reranker = ONNXReranker()
+
+    def rank(embedder, reranker):
+        from rag_system import RAGSystem
+
+        # Go through the production path: pre-tokenized pairs scored in length-sorted batches across all queries,
+        # since int8 activations are quantized per batch and a pair's score can depend on its neighbours
+        rag = RAGSystem(documents, embedding_model=embedder, reranker=reranker)
+        retrieval_rankings = [[doc for doc, _ in docs] for docs in rag.retrieve_batch(queries, top_k=top_k)]
+        reranked = rag.rerank_batch(queries, retrieval_rankings, top_k=top_k)
+        rerank_rankings = [[doc for doc, _ in docs[:config.TOP_K_RERANK]] for docs in reranked]
+        rerank_scores = [dict(docs) for docs in reranked]
+        return retrieval_rankings, rerank_rankings, rerank_scores
+
+    print(f"Ranking {len(queries)} queries against {len(documents)} documents...")
+    torch_retrieval, torch_rerank, torch_scores = rank(torch_embedder, torch_reranker)
+    onnx_retrieval, onnx_rerank, onnx_scores = rank(onnx_embedder, onnx_reranker)
+
+    retrieval_mismatches = []
+    rerank_mismatches = []
+    max_score_diff = 0.0
+    for i, query in enumerate(queries):
+        if torch_retrieval[i] != onnx_retrieval[i]:
+            retrieval_mismatches.append(query)
+        if torch_rerank[i] != onnx_rerank[i]:
+            rerank_mismatches.append(query)
+        for doc, score in torch_scores[i].items():
+            if doc in onnx_scores[i]:
+                max_score_diff = max(max_score_diff, abs(score - onnx_scores[i][doc]))
+
+    report = {
+        "quantized": config.ONNX_QUANTIZE,
+        "total_queries": len(queries),
+        "retrieval_top_k": top_k,
+        "rerank_top_k": config.TOP_K_RERANK,
+        "retrieval_mismatches": retrieval_mismatches,
+        "rerank_mismatches": rerank_mismatches,
+        "max_rerank_score_diff": max_score_diff,
+        "rankings_unchanged": not retrieval_mismatches and not rerank_mismatches,
+    }
+
+    print("\n" + "=" * 60)
+    print("ONNX Parity Check")
+    print("=" * 60)
+    print(f"Quantized: {report['quantized']}")
+    print(f"Retrieval ranking mismatches: {len(retrieval_mismatches)}/{len(queries)}")
+    print(f"Rerank ranking mismatches: {len(rerank_mismatches)}/{len(queries)}")
+    print(f"Max rerank score difference: {max_score_diff:.4f}")
+    for query in sorted(set(retrieval_mismatches + rerank_mismatches)):
+        print(f"  - {query}")
+    print("=" * 60)
+
+    return report
+
+
+def main():
+    from data_loader import MenuDataLoader, InputLoader
+
+    parser = argparse.ArgumentParser(
+        description="Export the embedding model and reranker to ONNX and check ranking parity"
+    )
+    parser.add_argument(
+        '--export-only',
+        action='store_true',
+        help='Only export (and quantize) the models into the ONNX cache'
+    )
+    args = parser.parse_args()
+
+    if args.export_only:
+        export_model(config.EMBEDDING_MODEL, ORTModelForFeatureExtraction)
+        export_model(config.RERANKER_MODEL, ORTModelForSequenceClassification)
+        return
+
+    documents = MenuDataLoader().get_documents_for_rag()
+    queries = InputLoader.load_queries()
+    report = check_parity(documents, queries)
+    sys.exit(0 if report["rankings_unchanged"] else 1)
+
+
+if __name__ == "__main__":
+    main()
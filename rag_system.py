@@ -1,33 +1,74 @@
-from typing import List, Tuple
+import hashlib
+import math
+import os
+import threading
+import torch
+
+from typing import Dict, List, Tuple
 from sentence_transformers import SentenceTransformer
 from FlagEmbedding import FlagReranker
 import faiss
 import config
+from embedding_reduction import EmbeddingReducer
+
+
+def load_embedding_model():
+    if config.INFERENCE_BACKEND == "onnx":
+        from onnx_backend import ONNXEmbedder
+        
+        # Exported (and optionally int8-quantized) model runs through ONNX Runtime
+        print(f"Loading ONNX embedding model: {config.EMBEDDING_MODEL}")
+        return ONNXEmbedder(config.EMBEDDING_MODEL)
+    
+    print(f"Loading embedding model: {config.EMBEDDING_MODEL}")
+    return SentenceTransformer(
+        config.EMBEDDING_MODEL,
+        cache_folder=config.MODEL_CACHE_DIR,
+        device=config.DEVICE
+    )
+
+
+def load_reranker():
+    if config.INFERENCE_BACKEND == "onnx":
+        from onnx_backend import ONNXReranker
+        
+        print(f"Loading ONNX reranker model: {config.RERANKER_MODEL}")
+        return ONNXReranker(config.RERANKER_MODEL)
+    
+    print(f"Loading reranker model: {config.RERANKER_MODEL}")
+    return FlagReranker(
+        config.RERANKER_MODEL,
+        cache_dir=config.MODEL_CACHE_DIR,
+        use_fp16=True if config.DEVICE == "cuda" else False
+    )
 
 
 class RAGSystem:
     
-    def __init__(self, documents: List[str]):
+    def __init__(
+        self,
+        documents: List[str],
+        parents: List[int] = None,
+        embedding_model=None,
+        reranker=None,
+        headers: List[str] = None
+    ):
         print("Initializing RAG system...")
         
         # Initialize embedding model
-        print(f"Loading embedding model: {config.EMBEDDING_MODEL}")
-        self.embedding_model = SentenceTransformer(
-            config.EMBEDDING_MODEL,
-            cache_folder=config.MODEL_CACHE_DIR,
-            device=config.DEVICE
-        )
+        self.embedding_model = embedding_model if embedding_model is not None else load_embedding_model()
         
         # Initialize reranker
-        print(f"Loading reranker model: {config.RERANKER_MODEL}")
-        self.reranker = FlagReranker(
-            config.RERANKER_MODEL,
-            cache_dir=config.MODEL_CACHE_DIR,
-            use_fp16=True if config.DEVICE == "cuda" else False
-        )
+        self.reranker = reranker if reranker is not None else load_reranker()
         
-        # Store documents
+        # Store documents (or chunks) with a pointer to the menu item each one belongs to
         self.documents = documents
+        self.parents = parents if parents is not None else list(range(len(documents)))
+        self.headers = headers
+        self.is_chunked = len(set(self.parents)) < len(self.parents)
+        self.parent_chunks = {}
+        for position, parent in enumerate(self.parents):
+            self.parent_chunks.setdefault(parent, []).append(position)
         
         # Build index
         print(f"Building vector index for {len(documents)} documents...")
@@ -36,6 +77,13 @@ class RAGSystem:
         print("RAG system initialized successfully!")
     
     def build_index(self):
+        # Reuse the index saved by an earlier run over the same documents and settings
+        index_prefix = self.get_index_prefix()
+        if self.load_index(index_prefix):
+            print(f"Loaded index with {self.index.ntotal} documents from {index_prefix}.index")
+            self.build_rerank_cache()
+            return
+        
         # Generate embeddings
         print("Generating embeddings...")
         embeddings = self.embedding_model.encode(
@@ -45,75 +93,249 @@ class RAGSystem:
             normalize_embeddings=True
         )
         
+        # Optionally reduce the embedding dimension (truncation or a projection fitted on the corpus)
+        self.reducer = EmbeddingReducer().fit(embeddings)
+        embeddings = self.reducer.apply(embeddings)
+        
         # Create FAISS index
         dimension = embeddings.shape[1]
         self.index = faiss.IndexFlatIP(dimension)
         self.index.add(embeddings.astype('float32'))
         
-        print(f"Index built with {self.index.ntotal} documents")
+        print(f"Index built with {self.index.ntotal} documents (dimension {dimension})")
+        
+        self.save_index(index_prefix)
+        
+        self.build_rerank_cache()
+    
+    def get_index_prefix(self) -> str:
+        # One file set per documents/embedding model/reduction combination, so settings never overwrite each other
+        fingerprint = hashlib.sha256()
+        settings = [
+            config.EMBEDDING_MODEL,
+            type(self.embedding_model).__name__,
+            getattr(self.embedding_model, "model_path", ""),
+            str(config.EMBEDDING_REDUCTION),
+            str(config.EMBEDDING_DIM),
+        ]
+        for part in settings + self.documents:
+            fingerprint.update(part.encode("utf-8") + b"\0")
+        return os.path.join(config.INDEX_DIR, f"menu-{fingerprint.hexdigest()[:16]}")
+    
+    def load_index(self, index_prefix: str) -> bool:
+        if not os.path.exists(f"{index_prefix}.index") or not os.path.exists(f"{index_prefix}.reduction.json"):
+            return False
+        
+        index = faiss.read_index(f"{index_prefix}.index")
+        reducer = EmbeddingReducer.load(index_prefix)
+        if reducer.method != config.EMBEDDING_REDUCTION or index.ntotal != len(self.documents):
+            return False
+        if reducer.method is not None and index.d != reducer.dimension:
+            return False
+        
+        self.index = index
+        self.reducer = reducer
+        return True
+    
+    def save_index(self, index_prefix: str):
+        # Persist the index and the projection it was built with side by side
+        os.makedirs(config.INDEX_DIR, exist_ok=True)
+        faiss.write_index(self.index, f"{index_prefix}.index")
+        self.reducer.save(index_prefix)
+    
+    def build_rerank_cache(self):
+        # Tokenize documents for the reranker once, so each request only tokenizes the query
+        print("Pre-tokenizing documents for reranker...")
+        self.doc_positions = {doc: i for i, doc in enumerate(self.documents)}
+        self.doc_token_ids = self.reranker.tokenizer(
+            self.documents,
+            add_special_tokens=False
+        )["input_ids"]
+        self.rerank_stats = {"queries": 0, "rerank_tokens": 0, "padded_tokens": 0}
+        # Load-test threads share one RAGSystem
+        self.stats_lock = threading.Lock()
     
     def retrieve(self, query: str, top_k: int = None) -> List[Tuple[str, float]]:
+        return self.retrieve_batch([query], top_k=top_k)[0]
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = None) -> List[List[Tuple[str, float]]]:
         if top_k is None:
             top_k = config.TOP_K_RETRIEVAL
         
-        # Generate query embedding
-        query_embedding = self.embedding_model.encode(
-            [query],
+        # Generate query embeddings
+        query_embeddings = self.embedding_model.encode(
+            queries,
             convert_to_numpy=True,
             normalize_embeddings=True
         )
         
-        # Search in FAISS index
+        query_embeddings = self.reducer.apply(query_embeddings)
+        
+        # Search in FAISS index (several chunks per item when chunked, so top_k distinct items are still found)
+        search_factor = config.CHUNK_SEARCH_FACTOR if self.is_chunked else 1
         scores, indices = self.index.search(
-            query_embedding.astype('float32'),
-            min(top_k, len(self.documents))
+            query_embeddings.astype('float32'),
+            min(top_k * search_factor, len(self.documents))
         )
         
-        # Return documents with scores
-        results = []
-        for idx, score in zip(indices[0], scores[0]):
-            if idx < len(self.documents):
+        # Keep the top_k items ranked by their best chunk (max-sim); only that chunk goes on to the reranker
+        all_results = []
+        for query_indices, query_scores in zip(indices, scores):
+            results = []
+            kept_parents = set()
+            for idx, score in zip(query_indices, query_scores):
+                if not 0 <= idx < len(self.documents) or self.parents[idx] in kept_parents:
+                    continue
+                kept_parents.add(self.parents[idx])
                 results.append((self.documents[idx], float(score)))
+                if len(results) == top_k:
+                    break
+            all_results.append(results)
+        
+        return all_results
+    
+    def get_doc_token_ids(self, doc: str) -> List[int]:
+        position = self.doc_positions.get(doc)
+        if position is not None:
+            return self.doc_token_ids[position]
+        return self.reranker.tokenizer(doc, add_special_tokens=False)["input_ids"]
+    
+    def score_batch(self, batch: List[Dict]) -> List[float]:
+        # Follow the reranker actually in use, which may have been passed in regardless of INFERENCE_BACKEND
+        if hasattr(self.reranker, "score_features"):
+            return self.reranker.score_features(batch)
+        
+        inputs = self.reranker.tokenizer.pad(batch, padding=True, return_tensors="pt")
+        inputs = {k: v.to(self.reranker.device) for k, v in inputs.items()}
+        with torch.no_grad():
+            logits = self.reranker.model(**inputs, return_dict=True).logits.view(-1).float()
+        return logits.cpu().tolist()
+    
+    def score_pairs(self, features: List[Dict]) -> List[float]:
+        # Bucket pairs by length so each batch is only padded to similar-length pairs
+        order = sorted(range(len(features)), key=lambda i: len(features[i]["input_ids"]))
+        scores = [0.0] * len(features)
+        
+        for start in range(0, len(order), config.RERANK_BATCH_SIZE):
+            batch_positions = order[start:start + config.RERANK_BATCH_SIZE]
+            batch = [features[i] for i in batch_positions]
+            logits = self.score_batch(batch)
+            
+            lengths = [len(feature["input_ids"]) for feature in batch]
+            with self.stats_lock:
+                self.rerank_stats["rerank_tokens"] += sum(lengths)
+                self.rerank_stats["padded_tokens"] += max(lengths) * len(lengths)
+            
+            for i, logit in zip(batch_positions, logits):
+                scores[i] = 1 / (1 + math.exp(-logit))
         
-        return results
+        return scores
     
     def rerank(self, query: str, documents: List[str], top_k: int = None) -> List[Tuple[str, float]]:
+        return self.rerank_batch([query], [documents], top_k=top_k)[0]
+    
+    def rerank_batch(
+        self,
+        queries: List[str],
+        documents_list: List[List[str]],
+        top_k: int = None
+    ) -> List[List[Tuple[str, float]]]:
         if top_k is None:
             top_k = config.TOP_K_RERANK
         
-        if not documents:
-            return []
+        tokenizer = self.reranker.tokenizer
         
-        # Prepare pairs for reranking
-        pairs = [[query, doc] for doc in documents]
+        # Build [query, doc] pairs from cached document tokens
+        features = []
+        owners = []
+        for query_pos, (query, documents) in enumerate(zip(queries, documents_list)):
+            if not documents:
+                continue
+            query_ids = tokenizer(query, add_special_tokens=False)["input_ids"]
+            for doc in documents:
+                features.append(tokenizer.prepare_for_model(
+                    query_ids,
+                    self.get_doc_token_ids(doc),
+                    truncation="longest_first",
+                    max_length=config.RERANK_MAX_LENGTH
+                ))
+                owners.append((query_pos, doc))
         
-        # Get reranking scores
-        scores = self.reranker.compute_score(pairs, normalize=True)
+        with self.stats_lock:
+            self.rerank_stats["queries"] += len(queries)
+        scores = self.score_pairs(features) if features else []
         
-        # Handle single document case
-        if not isinstance(scores, list):
-            scores = [scores]
+        # Sort by score within each query
+        all_results = [[] for _ in queries]
+        for (query_pos, doc), score in zip(owners, scores):
+            all_results[query_pos].append((doc, score))
         
-        # Sort by score
-        doc_score_pairs = list(zip(documents, scores))
-        doc_score_pairs.sort(key=lambda x: x[1], reverse=True)
+        for results in all_results:
+            results.sort(key=lambda x: x[1], reverse=True)
         
-        return doc_score_pairs[:top_k]
+        return [self.combine_by_parent(results)[:top_k] for results in all_results]
     
-    def retrieve_and_rerank(self, query: str) -> List[Tuple[str, float]]:
-        retrieved_docs = self.retrieve(query, top_k=config.TOP_K_RETRIEVAL)
-        if not retrieved_docs:
-            return []
+    def combine_by_parent(self, results: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+        # One entry per menu item; results are sorted, so the first chunk of an item holds its max score
+        groups = {}
+        for doc, score in results:
+            position = self.doc_positions.get(doc)
+            key = self.parents[position] if position is not None else doc
+            if key in groups:
+                continue
+            
+            if position is not None and self.is_chunked and config.CHUNK_CONTEXT == "item":
+                siblings = [self.documents[i] for i in self.parent_chunks[key] if i != position]
+                groups[key] = (self.merge_chunks([doc] + siblings), score)
+            elif position is not None and self.is_chunked and self.headers is not None:
+                groups[key] = (self.merge_chunks([self.headers[position], doc]), score)
+            else:
+                groups[key] = (doc, score)
         
-        candidate_docs = [doc for doc, _ in retrieved_docs]
+        return list(groups.values())
+    
+    def merge_chunks(self, docs: List[str]) -> str:
+        # Chunks and headers share the dish name (and sometimes the price); keep each line once
+        lines = []
+        for doc in docs:
+            for line in doc.split("\n"):
+                if line not in lines:
+                    lines.append(line)
+        return "\n".join(lines)
+    
+    def select_without_rerank(self, retrieved_docs: List[Tuple[str, float]], top_k: int = None) -> List[Tuple[str, float]]:
+        if top_k is None:
+            top_k = config.TOP_K_RERANK
         
-        reranked_docs = self.rerank(query, candidate_docs, top_k=config.TOP_K_RERANK)
+        # Keep the retrieval order and scores, merged per menu item like reranked results
+        ordered = sorted(retrieved_docs, key=lambda x: x[1], reverse=True)
+        return self.combine_by_parent(ordered)[:top_k]
+    
+    def get_rerank_stats(self) -> Dict:
+        with self.stats_lock:
+            queries = self.rerank_stats["queries"]
+            rerank_tokens = self.rerank_stats["rerank_tokens"]
+            padded_tokens = self.rerank_stats["padded_tokens"]
         
-        return reranked_docs
+        return {
+            "queries": queries,
+            "rerank_tokens_per_query": rerank_tokens / queries if queries else 0,
+            "padding_ratio": 1 - rerank_tokens / padded_tokens if padded_tokens else 0,
+        }
     
-    def get_context(self, query: str) -> str:
-        reranked_docs = self.retrieve_and_rerank(query)
+    def retrieve_and_rerank(self, query: str) -> List[Tuple[str, float]]:
+        return self.retrieve_and_rerank_batch([query])[0]
+    
+    def retrieve_and_rerank_batch(self, queries: List[str]) -> List[List[Tuple[str, float]]]:
+        retrieved_docs_list = self.retrieve_batch(queries, top_k=config.TOP_K_RETRIEVAL)
         
+        candidate_docs_list = [[doc for doc, _ in retrieved_docs] for retrieved_docs in retrieved_docs_list]
+        
+        reranked_docs_list = self.rerank_batch(queries, candidate_docs_list, top_k=config.TOP_K_RERANK)
+        
+        return reranked_docs_list
+    
+    def format_context(self, reranked_docs: List[Tuple[str, float]]) -> str:
         if not reranked_docs:
             return ""
         
@@ -121,4 +343,10 @@ class RAGSystem:
         for i, (doc, score) in enumerate(reranked_docs, 1):
             context_parts.append(f"[Thông tin {i}] (Độ liên quan: {score:.3f})\n{doc}")
         
-        return "\n\n".join(context_parts)
\ No newline at end of file
+        return "\n\n".join(context_parts)
+    
+    def get_context(self, query: str) -> str:
+        return self.format_context(self.retrieve_and_rerank(query))
+    
+    def get_contexts(self, queries: List[str]) -> List[str]:
+        return [self.format_context(docs) for docs in self.retrieve_and_rerank_batch(queries)]
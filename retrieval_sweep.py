@@ -0,0 +1,301 @@
+import argparse
+import json
+import os
+import re
+import time
+from typing import Dict, List, Tuple
+
+import config
+from data_loader import MenuDataLoader
+
+
+def normalize_name(text: str, lower: bool = True) -> str:
+    # Drop parenthesised variants such as "(Củ hũ dừa)" so short mentions still match
+    text = re.sub(r"\(.*?\)", "", text.lower() if lower else text)
+    return " ".join(text.split())
+
+
+def get_item_name(doc: str) -> str:
+    # Whole-item documents and chunks both start with the dish name
+    first_line = doc.split("\n", 1)[0]
+    return first_line.replace("Tên món ăn:", "").strip()
+
+
+def distinctive_prefixes(names: List[str]) -> List[str]:
+    # Shortest word prefix (at least two words) no other dish starts with, so "Canh Chua Cá Lóc" still
+    # matches "Canh Chua Cá Lóc Miền Tây" and "Chả Giò Rế" matches "Chả Giò Rế Hải Sản"
+    keys = [normalize_name(name) for name in names]
+    prefixes = []
+    for name, key in zip(names, keys):
+        words = normalize_name(name, lower=False).split()
+        prefix = " ".join(words)
+        for length in range(min(2, len(words)), len(words) + 1):
+            candidate = " ".join(words[:length]).lower()
+            if not any(other != key and (other + " ").startswith(candidate + " ") for other in keys):
+                prefix = " ".join(words[:length])
+                break
+        prefixes.append(prefix)
+    return prefixes
+
+
+def find_dishes(text: str, names: List[str], prefixes: List[str], case_sensitive: bool = False) -> List[str]:
+    lower = not case_sensitive
+    text = normalize_name(text, lower)
+    taken = []
+    found = []
+
+    # Longest patterns first; a match inside an already matched name ("Chả Giò" in "Bún Thịt Nướng Chả Giò") is skipped
+    patterns = [(normalize_name(name, lower), name) for name in names]
+    patterns += [(prefix.lower() if lower else prefix, name) for prefix, name in zip(prefixes, names)]
+    for pattern, name in sorted(patterns, key=lambda x: len(x[0]), reverse=True):
+        if not pattern:
+            continue
+        for match in re.finditer(rf"(?<!\w){re.escape(pattern)}(?!\w)", text):
+            if any(start <= match.start() and match.end() <= end for start, end in taken):
+                continue
+            taken.append((match.start(), match.end()))
+            found.append((match.start(), name))
+
+    # Report dishes in the order the text names them
+    ordered = []
+    for _, name in sorted(found):
+        if name not in ordered:
+            ordered.append(name)
+    return ordered
+
+
+def label_queries(pairs: List[Dict], menu_items: List[Dict]) -> List[Dict]:
+    names = [item["name"] for item in menu_items]
+    prefixes = distinctive_prefixes(names)
+
+    labeled = []
+    for pair in pairs:
+        # Dishes named in the question, plus those the reference answer names (multi-dish orders, suggestions).
+        # Answers name dishes in title case and ingredients ("chả giò rế") in lower case, so match them case-sensitively
+        relevant = find_dishes(pair["question"], names, prefixes)
+        for name in find_dishes(pair["answer"], names, prefixes, case_sensitive=True):
+            if name not in relevant:
+                relevant.append(name)
+        if relevant:
+            labeled.append({"question": pair["question"], "relevant": relevant})
+
+    return labeled
+
+
+def ranking_metrics(ranked_items: List[str], relevant: List[str]) -> Tuple[float, float]:
+    hits = set(ranked_items) & set(relevant)
+    recall = len(hits) / len(relevant)
+
+    reciprocal_rank = 0.0
+    for rank, item in enumerate(ranked_items, 1):
+        if item in relevant:
+            reciprocal_rank = 1 / rank
+            break
+
+    return recall, reciprocal_rank
+
+
+def unique_items(docs: List[Tuple[str, float]]) -> List[str]:
+    items = []
+    for doc, _ in docs:
+        name = get_item_name(doc)
+        if name not in items:
+            items.append(name)
+    return items
+
+
+def evaluate_setting(
+    rag,
+    llm_generator,
+    queries: List[Dict],
+    retrieval_ks: List[int],
+    rerank_ks: List[int],
+    setting: Dict
+) -> List[Dict]:
+    points = []
+
+    for retrieval_k in retrieval_ks:
+        totals = {"retrieval_ms": 0.0, "rerank_ms": 0.0, "recall": 0.0, "mrr": 0.0}
+        rerank_totals = {k: {"recall": 0.0, "mrr": 0.0, "prompt_tokens": 0} for k in rerank_ks if k <= retrieval_k}
+
+        for query in queries:
+            start = time.perf_counter()
+            retrieved = rag.retrieve(query["question"], top_k=retrieval_k)
+            totals["retrieval_ms"] += (time.perf_counter() - start) * 1000
+
+            recall, reciprocal_rank = ranking_metrics(unique_items(retrieved), query["relevant"])
+            totals["recall"] += recall
+            totals["mrr"] += reciprocal_rank
+
+            # Rerank once per query; each rerank cut-off is a prefix of the same ordering
+            start = time.perf_counter()
+            reranked = rag.rerank(query["question"], [doc for doc, _ in retrieved], top_k=max(rerank_ks))
+            totals["rerank_ms"] += (time.perf_counter() - start) * 1000
+
+            for rerank_k, metrics in rerank_totals.items():
+                recall, reciprocal_rank = ranking_metrics(unique_items(reranked[:rerank_k]), query["relevant"])
+                metrics["recall"] += recall
+                metrics["mrr"] += reciprocal_rank
+
+                prompt = llm_generator.create_prompt(query["question"], rag.format_context(reranked[:rerank_k]))
+                metrics["prompt_tokens"] += len(llm_generator.tokenizer(prompt)["input_ids"])
+
+        n = len(queries)
+        for rerank_k, metrics in rerank_totals.items():
+            points.append({
+                **setting,
+                "retrieval_k": retrieval_k,
+                "rerank_k": rerank_k,
+                "recall@retrieval": totals["recall"] / n,
+                "mrr@retrieval": totals["mrr"] / n,
+                "recall@rerank": metrics["recall"] / n,
+                "mrr@rerank": metrics["mrr"] / n,
+                "retrieval_ms": totals["retrieval_ms"] / n,
+                "rerank_ms": totals["rerank_ms"] / n,
+                "latency_ms": (totals["retrieval_ms"] + totals["rerank_ms"]) / n,
+                "prompt_tokens": metrics["prompt_tokens"] / n,
+            })
+
+    return points
+
+
+def dominates(a: Dict, b: Dict) -> bool:
+    better_or_equal = (
+        a["latency_ms"] <= b["latency_ms"]
+        and a["prompt_tokens"] <= b["prompt_tokens"]
+        and a["recall@rerank"] >= b["recall@rerank"]
+        and a["mrr@rerank"] >= b["mrr@rerank"]
+    )
+    strictly_better = (
+        a["latency_ms"] < b["latency_ms"]
+        or a["prompt_tokens"] < b["prompt_tokens"]
+        or a["recall@rerank"] > b["recall@rerank"]
+        or a["mrr@rerank"] > b["mrr@rerank"]
+    )
+    return better_or_equal and strictly_better
+
+
+def pareto_frontier(points: List[Dict]) -> List[Dict]:
+    frontier = [p for p in points if not any(dominates(other, p) for other in points if other is not p)]
+    return sorted(frontier, key=lambda p: p["latency_ms"])
+
+
+def describe(point: Dict) -> str:
+    return (
+        f"{point['backend']:>5} chunk={point['chunk_context'] if point['chunking'] else 'off':<5} "
+        f"red={point['reduction']:<12} k={point['retrieval_k']:>2}/{point['rerank_k']:<2} "
+        f"R@ret={point['recall@retrieval']:.3f} R@rr={point['recall@rerank']:.3f} "
+        f"MRR={point['mrr@rerank']:.3f} {point['latency_ms']:>8.1f} ms "
+        f"{point['prompt_tokens']:>7.1f} tok"
+    )
+
+
+def parse_list(value: str, cast=str) -> List:
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    from llm_generator import LLMGenerator
+    from rag_system import RAGSystem, load_embedding_model, load_reranker
+
+    parser = argparse.ArgumentParser(
+        description="Sweep retrieval settings and print the latency/quality Pareto frontier"
+    )
+    parser.add_argument('--retrieval-k', type=str, default='5,10,20', help='Comma-separated TOP_K_RETRIEVAL values')
+    parser.add_argument('--rerank-k', type=str, default='1,2,3,5', help='Comma-separated TOP_K_RERANK values')
+    parser.add_argument('--backends', type=str, default=config.INFERENCE_BACKEND, help='Comma-separated: torch, onnx')
+    parser.add_argument('--chunking', type=str, default='on,off', help='Comma-separated: on, off')
+    parser.add_argument('--chunk-context', type=str, default='chunk,item',
+                        help='Comma-separated context per item when chunking: chunk (best chunk + header), item')
+    parser.add_argument('--reductions', type=str, default='none',
+                        help='Comma-separated: none or method:dim, e.g. none,pca:256,truncate:512')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='Allowed drop in recall after reranking when picking the cheapest setting')
+    args = parser.parse_args()
+
+    with open(os.path.join(config.INPUT_DIR, "queries.json"), "r", encoding="utf-8") as f:
+        pairs = json.load(f)
+    menu_loader = MenuDataLoader()
+    queries = label_queries(pairs, menu_loader.get_all_items())
+    print(f"Labeled {len(queries)}/{len(pairs)} queries with their relevant dishes:")
+    for query in queries:
+        print(f"  {query['question']} -> {', '.join(query['relevant'])}")
+    labels_file = os.path.join(config.OUTPUT_DIR, "retrieval_sweep_labels.json")
+    with open(labels_file, 'w', encoding='utf-8') as f:
+        json.dump(queries, f, ensure_ascii=False, indent=2)
+    print(f"Saved labels for review: {labels_file}")
+
+    retrieval_ks = parse_list(args.retrieval_k, int)
+    rerank_ks = parse_list(args.rerank_k, int)
+    llm_generator = LLMGenerator(load_model=False)
+
+    points = []
+    for backend in parse_list(args.backends):
+        config.INFERENCE_BACKEND = backend
+        embedding_model = load_embedding_model()
+        reranker = load_reranker()
+
+        for chunking in parse_list(args.chunking):
+            if chunking == "on":
+                chunks = menu_loader.get_chunks_for_rag()
+                documents = [chunk["text"] for chunk in chunks]
+                parents = [chunk["parent"] for chunk in chunks]
+                headers = [chunk["header"] for chunk in chunks]
+                chunk_contexts = parse_list(args.chunk_context)
+            else:
+                documents = menu_loader.get_documents_for_rag()
+                parents = None
+                headers = None
+                chunk_contexts = [None]
+
+            for reduction in parse_list(args.reductions):
+                if reduction == "none":
+                    config.EMBEDDING_REDUCTION = None
+                else:
+                    method, dimension = reduction.split(":")
+                    config.EMBEDDING_REDUCTION = method
+                    config.EMBEDDING_DIM = int(dimension)
+
+                print(f"\nSetting: backend={backend} chunking={chunking} reduction={reduction}")
+                rag = RAGSystem(documents, parents, embedding_model=embedding_model, reranker=reranker, headers=headers)
+                # Projections may keep fewer dimensions than requested on a small menu
+                if rag.reducer.method in ("pca", "opq") and rag.reducer.dimension != rag.reducer.requested_dimension:
+                    reduction = f"{reduction}->{rag.reducer.dimension}"
+
+                # The chunk context only changes what reaches the prompt, so the same index serves both
+                for chunk_context in chunk_contexts:
+                    if chunk_context is not None:
+                        config.CHUNK_CONTEXT = chunk_context
+                    setting = {
+                        "backend": backend,
+                        "chunking": chunking == "on",
+                        "chunk_context": chunk_context,
+                        "reduction": reduction,
+                    }
+                    points.extend(evaluate_setting(rag, llm_generator, queries, retrieval_ks, rerank_ks, setting))
+
+    frontier = pareto_frontier(points)
+    best_recall = max(point["recall@rerank"] for point in points)
+    acceptable = [p for p in points if p["recall@rerank"] >= best_recall - args.tolerance]
+    cheapest = min(acceptable, key=lambda p: (p["latency_ms"], p["prompt_tokens"]))
+
+    print("\n" + "=" * 100)
+    print(f"Retrieval Sweep ({len(points)} configurations, {len(queries)} labeled queries)")
+    print("=" * 100)
+    for point in sorted(points, key=lambda p: p["latency_ms"]):
+        print(describe(point))
+    print("\nPareto frontier (latency, prompt tokens vs recall/MRR after reranking):")
+    for point in frontier:
+        print(describe(point))
+    print(f"\nCheapest within {args.tolerance:.2f} of best recall after reranking ({best_recall:.3f}):")
+    print(describe(cheapest))
+    print("=" * 100)
+
+    output_file = os.path.join(config.OUTPUT_DIR, "retrieval_sweep.json")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({"points": points, "frontier": frontier, "recommended": cheapest}, f, ensure_ascii=False, indent=2)
+    print(f"Saved: {output_file}")
+
+
+if __name__ == "__main__":
+    main()